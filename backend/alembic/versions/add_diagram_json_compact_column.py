@@ -0,0 +1,32 @@
+"""Add precomputed compact diagram_json column
+
+Revision ID: diagram_json_compact
+Revises: raw_text_hash_unique
+Create Date: 2026-08-28 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'diagram_json_compact'
+down_revision = 'raw_text_hash_unique'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'diagram_embeddings',
+        sa.Column('diagram_json_compact', sa.Text(), nullable=True)
+    )
+    # Backfill from the stored JSON; new rows get the truly compact form
+    # from the application on their next store
+    op.execute(
+        "UPDATE diagram_embeddings SET diagram_json_compact = diagram_json::text"
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('diagram_embeddings', 'diagram_json_compact')
@@ -0,0 +1,44 @@
+"""Add semantic response cache table
+
+Revision ID: add_response_cache
+Revises: diagram_json_compact
+Create Date: 2026-08-28 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from pgvector.sqlalchemy import HALFVEC
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_response_cache'
+down_revision = 'diagram_json_compact'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'diagram_response_cache',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('diagram_type', sa.String(), nullable=False),
+        sa.Column('embedding', HALFVEC(1536), nullable=False),
+        sa.Column('response_json', sa.JSON(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_diagram_response_cache_id'), 'diagram_response_cache', ['id'], unique=False)
+    op.create_index(op.f('ix_diagram_response_cache_diagram_type'), 'diagram_response_cache', ['diagram_type'], unique=False)
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_diagram_response_cache_hnsw "
+        "ON diagram_response_cache USING hnsw (embedding halfvec_cosine_ops) "
+        "WITH (m = 16, ef_construction = 64)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS idx_diagram_response_cache_hnsw")
+    op.drop_index(op.f('ix_diagram_response_cache_diagram_type'), table_name='diagram_response_cache')
+    op.drop_index(op.f('ix_diagram_response_cache_id'), table_name='diagram_response_cache')
+    op.drop_table('diagram_response_cache')
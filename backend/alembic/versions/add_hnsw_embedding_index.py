@@ -0,0 +1,42 @@
+"""Add HNSW index for embedding similarity search
+
+Revision ID: add_hnsw_index
+Revises: add_raw_text_hash
+Create Date: 2026-08-28 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_hnsw_index'
+down_revision = 'add_raw_text_hash'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Without a vector index pgvector falls back to a sequential scan plus
+    # sort for every ORDER BY embedding <=> query. HNSW with cosine ops keeps
+    # search cost logarithmic; ef_search is tuned per query via SET LOCAL.
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_diagram_embeddings_hnsw "
+        "ON diagram_embeddings USING hnsw (embedding halfvec_cosine_ops) "
+        "WITH (m = 16, ef_construction = 64)"
+    )
+    # Btree on diagram_type so the filtered search path stays cheap
+    op.create_index(
+        op.f('ix_diagram_embeddings_diagram_type'),
+        'diagram_embeddings',
+        ['diagram_type'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f('ix_diagram_embeddings_diagram_type'),
+        table_name='diagram_embeddings'
+    )
+    op.execute("DROP INDEX IF EXISTS idx_diagram_embeddings_hnsw")
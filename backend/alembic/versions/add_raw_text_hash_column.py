@@ -0,0 +1,43 @@
+"""Add indexed raw_text_hash column for exact-match lookups
+
+Revision ID: add_raw_text_hash
+Revises: embedding_halfvec
+Create Date: 2026-08-28 10:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_raw_text_hash'
+down_revision = 'embedding_halfvec'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'diagram_embeddings',
+        sa.Column('raw_text_hash', sa.String(length=64), nullable=True)
+    )
+    # Backfill existing rows; pgcrypto provides digest() for the one-off update
+    op.execute("CREATE EXTENSION IF NOT EXISTS pgcrypto")
+    op.execute(
+        "UPDATE diagram_embeddings "
+        "SET raw_text_hash = encode(digest(raw_text, 'sha256'), 'hex')"
+    )
+    op.create_index(
+        op.f('ix_diagram_embeddings_raw_text_hash'),
+        'diagram_embeddings',
+        ['raw_text_hash'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f('ix_diagram_embeddings_raw_text_hash'),
+        table_name='diagram_embeddings'
+    )
+    op.drop_column('diagram_embeddings', 'raw_text_hash')
@@ -0,0 +1,34 @@
+"""Store diagram embeddings as half-precision halfvec
+
+Revision ID: embedding_halfvec
+Revises: add_ibd_table
+Create Date: 2026-08-28 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'embedding_halfvec'
+down_revision = 'add_ibd_table'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # halfvec (float16) halves storage and I/O for the 1536-dim embeddings.
+    # Any vector index on this column must be rebuilt with halfvec_cosine_ops.
+    op.execute(
+        "ALTER TABLE diagram_embeddings "
+        "ALTER COLUMN embedding TYPE halfvec(1536) "
+        "USING embedding::halfvec(1536)"
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        "ALTER TABLE diagram_embeddings "
+        "ALTER COLUMN embedding TYPE vector(1536) "
+        "USING embedding::vector(1536)"
+    )
@@ -0,0 +1,39 @@
+"""Enforce uniqueness on IBD (parent diagram, block) pairs
+
+Revision ID: ibd_parent_block_unique
+Revises: json_to_jsonb
+Create Date: 2026-08-28 13:30:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'ibd_parent_block_unique'
+down_revision = 'json_to_jsonb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Remove duplicate IBD rows for the same (parent diagram, block) pair
+    # (keep the newest) before the unique index can be built
+    op.execute(
+        "DELETE FROM internal_block_diagrams a "
+        "USING internal_block_diagrams b "
+        "WHERE a.parent_bdd_diagram_id = b.parent_bdd_diagram_id "
+        "AND a.parent_block_id = b.parent_block_id AND a.id < b.id"
+    )
+    op.create_index(
+        'uq_internal_block_diagrams_parent_block',
+        'internal_block_diagrams',
+        ['parent_bdd_diagram_id', 'parent_block_id'],
+        unique=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        'uq_internal_block_diagrams_parent_block',
+        table_name='internal_block_diagrams'
+    )
@@ -0,0 +1,43 @@
+"""Convert JSON columns to JSONB
+
+Revision ID: json_to_jsonb
+Revises: add_response_cache
+Create Date: 2026-08-28 13:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'json_to_jsonb'
+down_revision = 'add_response_cache'
+branch_labels = None
+depends_on = None
+
+# (table, column) pairs for every json column in the schema
+JSON_COLUMNS = [
+    ("diagram_embeddings", "diagram_json"),
+    ("diagram_response_cache", "response_json"),
+    ("sysml_templates", "template_json"),
+    ("uav_components", "properties"),
+    ("internal_block_diagrams", "nodes"),
+    ("internal_block_diagrams", "edges"),
+]
+
+
+def upgrade() -> None:
+    # jsonb is parsed once at write time instead of re-parsed on every read,
+    # stores more compactly, and supports GIN indexing
+    for table, column in JSON_COLUMNS:
+        op.execute(
+            f"ALTER TABLE {table} ALTER COLUMN {column} "
+            f"TYPE jsonb USING {column}::jsonb"
+        )
+
+
+def downgrade() -> None:
+    for table, column in JSON_COLUMNS:
+        op.execute(
+            f"ALTER TABLE {table} ALTER COLUMN {column} "
+            f"TYPE json USING {column}::json"
+        )
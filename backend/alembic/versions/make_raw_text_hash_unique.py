@@ -0,0 +1,57 @@
+"""Enforce uniqueness on raw_text_hash
+
+Revision ID: raw_text_hash_unique
+Revises: add_hnsw_index
+Create Date: 2026-08-28 11:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'raw_text_hash_unique'
+down_revision = 'add_hnsw_index'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Remove duplicate raw_text rows (keep the newest) before the unique
+    # index can be built. Child IBDs of the doomed duplicates go first:
+    # parent_bdd_diagram_id has no ON DELETE CASCADE, so deleting their
+    # parents would otherwise abort with a foreign key violation
+    op.execute(
+        "DELETE FROM internal_block_diagrams ibd "
+        "USING diagram_embeddings a, diagram_embeddings b "
+        "WHERE ibd.parent_bdd_diagram_id = a.id "
+        "AND a.raw_text_hash = b.raw_text_hash AND a.id < b.id"
+    )
+    op.execute(
+        "DELETE FROM diagram_embeddings a "
+        "USING diagram_embeddings b "
+        "WHERE a.raw_text_hash = b.raw_text_hash AND a.id < b.id"
+    )
+    op.drop_index(
+        op.f('ix_diagram_embeddings_raw_text_hash'),
+        table_name='diagram_embeddings'
+    )
+    op.create_index(
+        op.f('ix_diagram_embeddings_raw_text_hash'),
+        'diagram_embeddings',
+        ['raw_text_hash'],
+        unique=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        op.f('ix_diagram_embeddings_raw_text_hash'),
+        table_name='diagram_embeddings'
+    )
+    op.create_index(
+        op.f('ix_diagram_embeddings_raw_text_hash'),
+        'diagram_embeddings',
+        ['raw_text_hash'],
+        unique=False
+    )
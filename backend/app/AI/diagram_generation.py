@@ -1,6 +1,6 @@
-from openai import OpenAI
 import json
 from typing import Dict, Any, List, Optional, Union
+from app.core.clients import sync_openai_client
 from app.core.config import settings
 
 # Define positioning constants
@@ -273,6 +273,42 @@ Rules:
 12. **MANDATORY EDGES EXAMPLE: For 3 internal components, you must include at least 2-3 edges like: {"id": "cpu-memory", "source": "ibd-cpu", "target": "ibd-memory", "label": "Data Bus"}**
 """
 
+def extract_internal_diagrams(raw_diagram: Dict[str, Any]) -> tuple:
+    """
+    Split embedded internal_diagram payloads out of a bdd_enhanced response.
+
+    Returns (cleaned_diagram, ibd_to_create): the diagram with IBD-bearing
+    elements rewritten (internal_diagram removed, data.has_ibd set for the
+    frontend) and the list of IBD dicts to persist. Elements are rebuilt in
+    a single pass rather than popping keys and growing nested dicts on the
+    AI response in place.
+    """
+    elements = raw_diagram.get("elements")
+    if not elements:
+        return raw_diagram, []
+
+    ibd_to_create = []
+    cleaned_elements = []
+    for element in elements:
+        ibd_data = element.get("internal_diagram")
+        if ibd_data is None:
+            cleaned_elements.append(element)
+            continue
+
+        cleaned = {key: value for key, value in element.items() if key != "internal_diagram"}
+        cleaned["data"] = {**element.get("data", {}), "has_ibd": True}
+        cleaned_elements.append(cleaned)
+        ibd_to_create.append({
+            "parent_block_id": element["id"],
+            "nodes": ibd_data.get("nodes", []),
+            "edges": ibd_data.get("edges", []),
+        })
+
+    if not ibd_to_create:
+        return raw_diagram, []
+    return {**raw_diagram, "elements": cleaned_elements}, ibd_to_create
+
+
 def generate_sysml_diagram(
     prompt: str,
     diagram_type: str,
@@ -289,8 +325,6 @@ def generate_sysml_diagram(
     Returns:
         Dictionary containing the raw diagram and metadata.
     """
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
-
     # Select the appropriate prompt based on the requested diagram type
     if diagram_type == "bdd_enhanced":
         system_prompt = BDD_ENHANCED_PROMPT_TEMPLATE
@@ -306,7 +340,13 @@ def generate_sysml_diagram(
         for example in one_shot_examples:
             example_input = f"System description:\n\n{example['input']}"
             messages.append({"role": "user", "content": example_input})
-            example_output = json.dumps(example['output'], indent=2)
+            # Outputs stored as precomputed JSON strings pass straight
+            # through; dicts are serialized compactly (indentation only
+            # inflates prompt tokens)
+            if isinstance(example['output'], str):
+                example_output = example['output']
+            else:
+                example_output = json.dumps(example['output'], separators=(',', ':'), ensure_ascii=False)
             messages.append({"role": "assistant", "content": example_output})
 
     user_prompt = f"Generate a diagram for the following system description:\n\n{prompt}"
@@ -315,7 +355,7 @@ def generate_sysml_diagram(
     print(f"\n==== Sending prompt to model ({settings.OPENAI_GENERATIVE_MODEL}) ====")
 
     try:
-        response = client.chat.completions.create(
+        response = sync_openai_client.chat.completions.create(
             model=settings.OPENAI_GENERATIVE_MODEL,
             messages=messages,
             response_format={"type": "json_object"},
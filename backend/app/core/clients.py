@@ -0,0 +1,25 @@
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+from app.core.config import settings
+
+# Process-wide OpenAI client singletons. Constructing a client per module (or
+# per call) creates a separate httpx connection pool each time; sharing one
+# instance keeps keep-alive connections warm so repeat requests skip the TLS
+# handshake.
+
+# Async client for the embedding paths (event loop friendly)
+openai_client = AsyncOpenAI(
+    api_key=settings.OPENAI_API_KEY,
+    http_client=httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+    )
+)
+
+# Sync client for the diagram-generation path, which still runs synchronously
+sync_openai_client = OpenAI(
+    api_key=settings.OPENAI_API_KEY,
+    http_client=httpx.Client(
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+    )
+)
@@ -9,11 +9,22 @@ class Settings(BaseSettings):
     
     # Application version
     APP_VERSION: str = "1.0"
+
+    # Comma-separated list of origins allowed to call the API
+    BACKEND_CORS_ORIGINS: str = "http://localhost:3000"
+
+    @property
+    def cors_origins(self) -> list[str]:
+        return [origin.strip() for origin in self.BACKEND_CORS_ORIGINS.split(",") if origin.strip()]
     
     # Database settings
     DB_URL: str = "postgresql+asyncpg://postgres:postgres@db:5432/postgres"
     DB_URL_SYNC: str = "postgresql+psycopg2://postgres:postgres@db:5432/postgres"
 
+    # Create tables on startup. Set to False when running multiple uvicorn
+    # workers so the DDL runs once out of band instead of once per worker
+    RUN_DB_INIT: bool = True
+
     class Config:
         env_file = ".env"
         extra = "ignore"
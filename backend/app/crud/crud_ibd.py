@@ -1,5 +1,6 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update, desc
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from app.database import models
 from app.database.models import InternalBlockDiagramCreate
 from typing import List, Dict, Any
@@ -29,6 +30,54 @@ async def update_ibd(db: AsyncSession, db_ibd: models.InternalBlockDiagram, node
     await db.refresh(db_ibd)
     return db_ibd
 
+async def bulk_upsert_ibds(
+    db: AsyncSession,
+    parent_bdd_id: int,
+    ibds: List[Dict[str, Any]],
+    source: str = 'ai'
+) -> List[int]:
+    """
+    Upserts all IBDs for a parent diagram in one multi-row statement.
+    Replaces the per-block get-then-create/update loop (2xN round-trips)
+    with a single INSERT ... ON CONFLICT DO UPDATE on the
+    (parent_bdd_diagram_id, parent_block_id) unique index.
+    Returns the affected row IDs.
+    """
+    if not ibds:
+        return []
+
+    # Dedupe by block ID (keep the last occurrence): the AI can emit two
+    # elements with the same id, and ON CONFLICT DO UPDATE rejects a batch
+    # that touches the same row twice
+    deduped = {ibd["parent_block_id"]: ibd for ibd in ibds}
+
+    stmt = pg_insert(models.InternalBlockDiagram).values([
+        {
+            "parent_bdd_diagram_id": parent_bdd_id,
+            "parent_block_id": ibd["parent_block_id"],
+            "nodes": ibd["nodes"],
+            "edges": ibd["edges"],
+            "source": source,
+        }
+        for ibd in deduped.values()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[
+            models.InternalBlockDiagram.parent_bdd_diagram_id,
+            models.InternalBlockDiagram.parent_block_id,
+        ],
+        set_={
+            "nodes": stmt.excluded.nodes,
+            "edges": stmt.excluded.edges,
+            "source": stmt.excluded.source,
+        }
+    ).returning(models.InternalBlockDiagram.id)
+
+    result = await db.execute(stmt)
+    ids = list(result.scalars().all())
+    await db.commit()
+    return ids
+
 async def get_ibd_by_block_id(db: AsyncSession, block_id: str):
     """
     Gets an IBD by its parent block ID. Reverted to simpler logic
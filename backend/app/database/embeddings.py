@@ -1,287 +1,658 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Union
+import asyncio
+import hashlib
 import json
-from datetime import datetime
+import logging
+from datetime import datetime, timedelta
 
-import numpy as np
-from openai import OpenAI
-from sqlalchemy import select, func
+import random
+
+import tiktoken
+from aiolimiter import AsyncLimiter
+from cachetools import TTLCache
+from openai import RateLimitError
+from pgvector.asyncpg import register_vector
+from sqlalchemy import select, func, text, delete, lambda_stmt
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
 
+from app.core.clients import openai_client as client
 from app.core.config import settings
-from app.database.models import DiagramEmbedding, SysMLTemplate, UAVComponent
+from app.database.rag_cache import rag_context_cache
+from app.database.models import (
+    DiagramEmbedding,
+    DiagramResponseCache,
+    SysMLTemplate,
+    UAVComponent
+)
 
-# Initialize OpenAI client
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
+logger = logging.getLogger(__name__)
 
-async def generate_embedding(text: str) -> List[float]:
+# In-process cache of recent similarity-search results. Only primary-key IDs
+# (and scores) are cached, never ORM instances - those are bound to a session
+# and must be re-fetched per request. The whole cache is invalidated by
+# bumping _search_cache_version whenever a diagram is stored or updated.
+# HNSW search-time candidate list size; larger values trade latency for
+# recall and can be tuned without rebuilding the index. Re-tuned from the
+# actual table size at startup via tune_hnsw_for_table_size.
+HNSW_EF_SEARCH = 40
+
+
+def configure_hnsw_params(total_rows: int) -> Dict[str, int]:
+    """
+    Pick HNSW parameters appropriate for the current table size.
+    The defaults are fine for small deployments, but recall and build
+    behavior degrade past ~100k vectors unless m/ef_construction grow.
+    """
+    if total_rows < 100_000:
+        return {"m": 16, "ef_construction": 64, "ef_search": 40}
+    if total_rows < 1_000_000:
+        return {"m": 24, "ef_construction": 100, "ef_search": 100}
+    return {"m": 32, "ef_construction": 128, "ef_search": 200}
+
+
+async def tune_hnsw_for_table_size(db: AsyncSession) -> Dict[str, int]:
     """
-    Generate OpenAI embedding vector for text
+    Read the diagram count and adjust the module-level ef_search used by
+    find_similar_diagrams. Index-build parameters (m / ef_construction) are
+    reported so an operator can rebuild the index when crossing a size tier.
     """
-    response = client.embeddings.create(
-        model="text-embedding-ada-002",
-        input=text
+    global HNSW_EF_SEARCH
+    result = await db.execute(select(func.count(DiagramEmbedding.id)))
+    total_rows = result.scalar() or 0
+    params = configure_hnsw_params(total_rows)
+    HNSW_EF_SEARCH = params["ef_search"]
+    logger.info("HNSW tuning: %s diagrams -> ef_search=%s (recommended index params: m=%s, ef_construction=%s)",
+                total_rows, params["ef_search"], params["m"], params["ef_construction"])
+    return params
+
+_search_cache: TTLCache = TTLCache(maxsize=2048, ttl=300)
+_search_cache_lock = asyncio.Lock()
+_search_cache_version = 0
+
+
+def _metadata_only():
+    """
+    Loader option restricting a DiagramEmbedding select to the columns the
+    API response models actually expose. Skipping the ~6KB embedding vector
+    and the diagram JSON per row keeps the metadata-only paths cheap.
+    """
+    return load_only(
+        DiagramEmbedding.id,
+        DiagramEmbedding.name,
+        DiagramEmbedding.description,
+        DiagramEmbedding.diagram_type,
+        DiagramEmbedding.created_at
     )
-    return response.data[0].embedding
+
+
+def _search_cache_key(
+    query_text: str,
+    limit: int,
+    diagram_type: Optional[str],
+    include_scores: bool
+) -> Tuple:
+    """Build a cache key for a similarity search request"""
+    text_hash = hashlib.blake2b(query_text.encode(), digest_size=16).hexdigest()
+    return (_search_cache_version, text_hash, limit, diagram_type, include_scores)
+
+
+def _invalidate_search_cache() -> None:
+    """Invalidate all cached similarity-search results"""
+    global _search_cache_version
+    _search_cache_version += 1
+    rag_context_cache.invalidate()
+
+
+async def _fetch_cached_diagrams(
+    db: AsyncSession,
+    cached: List[Tuple[int, Optional[float]]],
+    include_scores: bool
+) -> Union[List[DiagramEmbedding], List[Tuple[DiagramEmbedding, float]]]:
+    """
+    Re-fetch cached search results by primary key, preserving the cached order
+    """
+    ids = [diagram_id for diagram_id, _ in cached]
+    stmt = select(DiagramEmbedding).filter(DiagramEmbedding.id.in_(ids))
+    if not include_scores:
+        # Scoreless callers only ever serialize metadata columns
+        stmt = stmt.options(_metadata_only())
+    result = await db.execute(stmt)
+    diagrams_by_id = {diagram.id: diagram for diagram in result.scalars().all()}
+
+    diagrams = []
+    for diagram_id, score in cached:
+        diagram = diagrams_by_id.get(diagram_id)
+        if diagram is None:
+            # Row was deleted after it was cached, skip it
+            continue
+        diagrams.append((diagram, score) if include_scores else diagram)
+    return diagrams
+
+# Embeddings for a given text are immutable, so repeated raw_text/query
+# submissions can reuse the vector instead of paying another OpenAI call.
+# Keyed by SHA-256 of the text; one day TTL keeps memory bounded.
+_embedding_cache: TTLCache = TTLCache(maxsize=4096, ttl=86400)
+_embedding_cache_lock = asyncio.Lock()
+
+# The embedding API rejects inputs above 8191 tokens; stay safely below that
+_EMBEDDING_TOKEN_LIMIT = 8000
+_embedding_encoder = None
+
+
+def _truncate_to_token_limit(text: str) -> str:
+    """
+    Truncate text to the embedding model's token limit using tiktoken.
+    Oversized inputs would otherwise fail with a 400 error after a full
+    round-trip to OpenAI.
+    """
+    global _embedding_encoder
+    try:
+        if _embedding_encoder is None:
+            _embedding_encoder = tiktoken.encoding_for_model("text-embedding-ada-002")
+    except Exception as e:
+        # Encoder data could not be loaded (e.g. no network for the BPE file);
+        # fall back to sending the text unchanged
+        logger.warning("Could not load tiktoken encoder: %s", e)
+        return text
+
+    tokens = _embedding_encoder.encode(text)
+    if len(tokens) > _EMBEDDING_TOKEN_LIMIT:
+        logger.info("Truncating embedding input from %s to %s tokens", len(tokens), _EMBEDDING_TOKEN_LIMIT)
+        return _embedding_encoder.decode(tokens[:_EMBEDDING_TOKEN_LIMIT])
+    return text
+
+
+# Concurrency/rate controls for the embedding API. The semaphore bounds
+# in-flight requests so bulk ingests don't saturate the event loop; the
+# limiter keeps us under the documented requests-per-minute ceiling so we
+# run at full speed without 429-thrashing.
+_EMBEDDING_MAX_RETRIES = 5
+_embedding_semaphore = asyncio.Semaphore(5)
+_embedding_rate_limiter = AsyncLimiter(3000, 60)
+
+
+async def _create_embeddings(input_data: Union[str, List[str]]):
+    """
+    Call the OpenAI embeddings endpoint under bounded concurrency and rate
+    limiting, retrying 429s with exponential backoff. Retry-After from the
+    API is honored, and jitter avoids a thundering herd when many callers
+    back off at once.
+    """
+    for attempt in range(_EMBEDDING_MAX_RETRIES):
+        async with _embedding_semaphore, _embedding_rate_limiter:
+            try:
+                return await client.embeddings.create(
+                    model="text-embedding-ada-002",
+                    input=input_data
+                )
+            except RateLimitError as e:
+                if attempt == _EMBEDDING_MAX_RETRIES - 1:
+                    raise
+                retry_after = None
+                if e.response is not None:
+                    retry_after = e.response.headers.get("retry-after")
+                delay = float(retry_after) if retry_after else min(2 ** attempt, 30)
+                delay += random.uniform(0, 0.5)
+                logger.warning("OpenAI rate limit hit, retrying embedding call in %.1fs (attempt %s/%s)",
+                               delay, attempt + 1, _EMBEDDING_MAX_RETRIES)
+        await asyncio.sleep(delay)
+
+
+async def generate_embedding(text: str) -> List[float]:
+    """
+    Generate OpenAI embedding vector for text, reusing a cached vector when
+    the exact same text was embedded recently
+    """
+    cache_key = _hash_raw_text(text)
+    async with _embedding_cache_lock:
+        cached = _embedding_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    response = await _create_embeddings(_truncate_to_token_limit(text))
+    embedding = response.data[0].embedding
+    async with _embedding_cache_lock:
+        _embedding_cache[cache_key] = embedding
+    return embedding
+
+async def generate_embeddings(texts: List[str]) -> List[List[float]]:
+    """
+    Generate OpenAI embedding vectors for multiple texts in a single API call.
+    One batched request replaces N sequential round-trips; cached texts are
+    not re-submitted.
+    """
+    if not texts:
+        return []
+
+    keys = [_hash_raw_text(text) for text in texts]
+    async with _embedding_cache_lock:
+        embeddings = [_embedding_cache.get(key) for key in keys]
+
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        response = await _create_embeddings(
+            [_truncate_to_token_limit(texts[i]) for i in missing]
+        )
+        # The API does not guarantee response order, so sort by input index
+        fresh = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        async with _embedding_cache_lock:
+            for i, embedding in zip(missing, fresh):
+                embeddings[i] = embedding
+                _embedding_cache[keys[i]] = embedding
+
+    return embeddings
+
+def _hash_raw_text(raw_text: str) -> str:
+    """SHA-256 hex digest used for exact-match raw_text lookups"""
+    return hashlib.sha256(raw_text.encode()).hexdigest()
+
 
 async def find_diagram_by_raw_text(db: AsyncSession, raw_text: str) -> Optional[DiagramEmbedding]:
     """
-    Find a diagram by its raw_text field
+    Find a diagram by its raw_text field via the indexed hash column
     """
-    stmt = select(DiagramEmbedding).filter(DiagramEmbedding.raw_text == raw_text)
+    text_hash = _hash_raw_text(raw_text)
+    stmt = lambda_stmt(
+        lambda: select(DiagramEmbedding).filter(DiagramEmbedding.raw_text_hash == text_hash)
+    )
     result = await db.execute(stmt)
     return result.scalars().first()
 
-async def optimize_diagram_json(diagram_json: Dict[str, Any]) -> Dict[str, Any]:
+def _optimize_element(node: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a frontend node to the element format used in the prompt"""
+    data = node["data"]
+    return {
+        "id": node["id"],
+        "type": node["type"],
+        "name": data.get("label", ""),
+        "description": data.get("description", ""),
+        # Include all meaningful properties (the node's own id is redundant)
+        "properties": {
+            key: value
+            for key, value in data.get("properties", {}).items()
+            if key != "id"
+        }
+    }
+
+
+def _optimize_relationship(edge: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a frontend edge to the relationship format used in the prompt"""
+    relationship = {
+        "source_id": edge["source"],
+        "target_id": edge["target"],
+        "type": edge["type"]
+    }
+    # Add label/name if available
+    data = edge.get("data")
+    if data and "name" in data:
+        relationship["name"] = data["name"]
+    elif edge.get("label"):
+        relationship["name"] = edge["label"]
+    return relationship
+
+
+def optimize_diagram_json(diagram_json: Dict[str, Any]) -> Dict[str, Any]:
     """
     Optimize the diagram JSON structure to match the exact format from the prompt.
     Position information is removed since we use Dagre for automatic positioning.
     Converts nodes/edges format to elements/relationships format for RAG consistency.
+
+    Pure CPU work - deliberately synchronous so callers don't pay a coroutine
+    round-trip for dict walking.
     """
-    # Create the output structure exactly matching the prompt format
-    optimized_json = {
+    return {
         "diagram_type": "block",
-        "elements": [],
-        "relationships": []
+        "elements": [_optimize_element(node) for node in diagram_json.get("nodes", ())],
+        "relationships": [_optimize_relationship(edge) for edge in diagram_json.get("edges", ())]
     }
-    
-    # Process nodes -> elements (matching prompt format)
-    if "nodes" in diagram_json:
-        for node in diagram_json["nodes"]:
-            # Create element in the exact format as specified in the prompt
-            element = {
-                "id": node["id"],
-                "type": node["type"],
-                "name": node["data"].get("label", ""),
-                "description": node["data"].get("description", "")
-            }
-            
-            # Add properties if available
-            if "properties" in node["data"]:
-                element["properties"] = {}
-                for key, value in node["data"]["properties"].items():
-                    # Include all meaningful properties
-                    if key != "id" or key == "name":
-                        element["properties"][key] = value
-            else:
-                element["properties"] = {}
-                
-            optimized_json["elements"].append(element)
-    
-    # Process edges -> relationships (matching prompt format)
-    if "edges" in diagram_json:
-        for edge in diagram_json["edges"]:
-            # Create relationship in the exact format as specified in the prompt
-            relationship = {
-                "source_id": edge["source"],
-                "target_id": edge["target"],
-                "type": edge["type"]
-            }
-            
-            # Add label/name if available
-            if "data" in edge and edge["data"] and "name" in edge["data"]:
-                relationship["name"] = edge["data"]["name"]
-            elif "label" in edge and edge["label"]:
-                relationship["name"] = edge["label"]
-                
-            optimized_json["relationships"].append(relationship)
-    
-    return optimized_json
 
 async def store_diagram_with_embedding(
     db: AsyncSession, 
     name: str, 
     description: str, 
-    raw_text: str, 
-    diagram_type: str, 
-    diagram_json: Dict[str, Any]
+    raw_text: str,
+    diagram_type: str,
+    diagram_json: Dict[str, Any],
+    precomputed_embedding: Optional[List[float]] = None
 ) -> DiagramEmbedding:
     """
-    Store a diagram with its embedding vector in the database
-    If a diagram with the same raw_text exists, update it instead of creating a new one
-    """
-    print(f"\n==== STORING DIAGRAM ====")
-    print(f"Database session: {db}")
-    print(f"Diagram name: {name}")
-    print(f"Diagram type: {diagram_type}")
-    print(f"Description length: {len(description)}")
-    print(f"Raw text length: {len(raw_text)}")
-    
-    # First, check if a diagram with the same raw_text already exists
-    existing_diagram = await find_diagram_by_raw_text(db, raw_text)
-    print(f"Existing diagram found: {existing_diagram is not None}")
-    
-    # Optimize the diagram JSON structure
-    optimized_json = await optimize_diagram_json(diagram_json)
-    print(f"JSON optimized: {len(str(optimized_json))} characters")
-    
-    # Generate embedding for the raw text
-    embedding_vector = await generate_embedding(raw_text)
-    print(f"Embedding generated: {len(embedding_vector)} dimensions")
-    
+    Store a diagram with its embedding vector in the database.
+    Upserts on raw_text_hash: a diagram with the same raw_text is updated
+    in place, atomically, instead of creating a duplicate.
+
+    Callers that already embedded raw_text (e.g. for a similarity search on
+    the same request) pass the vector via precomputed_embedding so the store
+    is a pure database write.
+    """
+    logger.debug("Storing diagram '%s' (type=%s, description=%s chars, raw_text=%s chars)",
+                 name, diagram_type, len(description), len(raw_text))
+
+    # Optimize the diagram JSON structure and serialize it compactly once,
+    # so read paths can reuse the string instead of re-dumping the dict
+    optimized_json = optimize_diagram_json(diagram_json)
+    compact_json = json.dumps(optimized_json, separators=(',', ':'), ensure_ascii=False)
+
+    # Generate embedding for the raw text unless the caller provided one
+    if precomputed_embedding is not None:
+        embedding_vector = precomputed_embedding
+    else:
+        embedding_vector = await generate_embedding(raw_text)
+    logger.debug("Embedding has %s dimensions", len(embedding_vector))
+
     try:
-        if existing_diagram:
-            print(f"Updating existing diagram (ID: {existing_diagram.id})")
-            # Update the existing diagram
-            existing_diagram.name = name
-            existing_diagram.description = description
-            existing_diagram.diagram_type = diagram_type
-            existing_diagram.diagram_json = optimized_json
-            existing_diagram.embedding = embedding_vector
-            existing_diagram.updated_at = datetime.utcnow()
-            
-            await db.commit()
-            print(f"Database commit successful for update")
-            await db.refresh(existing_diagram)
-            print(f"Database refresh successful")
-            return existing_diagram
-        else:
-            print(f"Creating new diagram embedding record")
-            # Create a new diagram embedding record
-            db_embedding = DiagramEmbedding(
-                name=name,
-                description=description,
-                raw_text=raw_text,
-                diagram_type=diagram_type,
-                diagram_json=optimized_json,
-                embedding=embedding_vector
-            )
-            
-            # Save to database
-            db.add(db_embedding)
-            print(f"Added new diagram to session")
-            await db.commit()
-            print(f"Database commit successful for new diagram")
-            await db.refresh(db_embedding)
-            print(f"Database refresh successful")
-            print(f"New diagram ID: {db_embedding.id}")
-            
-            return db_embedding
-    except Exception as e:
-        print(f"ERROR storing diagram: {str(e)}")
+        # One atomic round-trip: insert, or update the existing row with the
+        # same raw_text_hash. Replaces the old SELECT-then-UPDATE/INSERT
+        # pattern, which cost extra round-trips and could race under
+        # concurrent stores of the same text.
+        stmt = pg_insert(DiagramEmbedding).values(
+            name=name,
+            description=description,
+            raw_text=raw_text,
+            raw_text_hash=_hash_raw_text(raw_text),
+            diagram_type=diagram_type,
+            diagram_json=optimized_json,
+            diagram_json_compact=compact_json,
+            embedding=embedding_vector
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[DiagramEmbedding.raw_text_hash],
+            set_={
+                "name": stmt.excluded.name,
+                "description": stmt.excluded.description,
+                "diagram_type": stmt.excluded.diagram_type,
+                "diagram_json": stmt.excluded.diagram_json,
+                "diagram_json_compact": stmt.excluded.diagram_json_compact,
+                "embedding": stmt.excluded.embedding,
+                "updated_at": datetime.utcnow()
+            }
+        ).returning(DiagramEmbedding)
+
+        result = await db.execute(stmt)
+        db_embedding = result.scalars().one()
+        await db.commit()
+        _invalidate_search_cache()
+        logger.info("Diagram '%s' upserted successfully (ID: %s)", name, db_embedding.id)
+        return db_embedding
+    except Exception:
+        logger.exception("Error storing diagram '%s'", name)
         await db.rollback()
         raise
 
+async def bulk_store_diagrams(
+    db: AsyncSession,
+    diagrams: List[Dict[str, Any]]
+) -> int:
+    """
+    Bulk-ingest diagrams using PostgreSQL's COPY protocol.
+
+    Intended for bulk migration / initial indexing, where per-row
+    add/commit/refresh round-trips are orders of magnitude slower than a
+    single COPY stream. Each item must provide name, description, raw_text,
+    diagram_type and diagram_json; an "embedding" key may carry a
+    precomputed vector, otherwise one is generated.
+
+    Rows whose raw_text is already stored are updated in place, matching
+    the single-row upsert semantics of store_diagram_with_embedding.
+    Returns the number of rows inserted or updated.
+    """
+    if not diagrams:
+        return 0
+
+    # Dedupe by raw_text_hash (keep the last occurrence) so the batch cannot
+    # conflict with itself on the unique index
+    deduped = {_hash_raw_text(item["raw_text"]): item for item in diagrams}
+    diagrams = list(deduped.values())
+
+    logger.info("Bulk storing %s diagrams", len(diagrams))
+
+    # Embed all texts without a precomputed vector in one batched API call
+    missing = [i for i, item in enumerate(diagrams) if item.get("embedding") is None]
+    if missing:
+        batch_embeddings = await generate_embeddings([diagrams[i]["raw_text"] for i in missing])
+        for i, embedding in zip(missing, batch_embeddings):
+            diagrams[i]["embedding"] = embedding
+
+    now = datetime.utcnow()
+    records = []
+    for item in diagrams:
+        optimized_json = optimize_diagram_json(item["diagram_json"])
+        compact_json = json.dumps(optimized_json, separators=(',', ':'), ensure_ascii=False)
+        records.append((
+            now,
+            now,
+            item["name"],
+            item.get("description", ""),
+            item["raw_text"],
+            _hash_raw_text(item["raw_text"]),
+            item["diagram_type"],
+            compact_json,
+            compact_json,
+            item["embedding"],
+        ))
+
+    # Drop down to the raw asyncpg connection for copy_records_to_table;
+    # register_vector teaches it pgvector's binary wire format
+    connection = await db.connection()
+    asyncpg_conn = (await connection.get_raw_connection()).driver_connection
+    await register_vector(asyncpg_conn)
+
+    # COPY into a staging table, then upsert into diagram_embeddings: a
+    # direct COPY would raise UniqueViolation for any raw_text_hash that is
+    # already stored (e.g. a re-run of the same ingest job)
+    columns = [
+        "created_at", "updated_at", "name", "description",
+        "raw_text", "raw_text_hash", "diagram_type",
+        "diagram_json", "diagram_json_compact", "embedding",
+    ]
+    await asyncpg_conn.execute(
+        "CREATE TEMP TABLE diagram_embeddings_stage "
+        "(LIKE diagram_embeddings) ON COMMIT DROP"
+    )
+    await asyncpg_conn.copy_records_to_table(
+        "diagram_embeddings_stage",
+        records=records,
+        columns=columns,
+    )
+    column_list = ", ".join(columns)
+    await asyncpg_conn.execute(
+        f"INSERT INTO diagram_embeddings ({column_list}) "
+        f"SELECT {column_list} FROM diagram_embeddings_stage "
+        "ON CONFLICT (raw_text_hash) DO UPDATE SET "
+        "name = EXCLUDED.name, "
+        "description = EXCLUDED.description, "
+        "diagram_type = EXCLUDED.diagram_type, "
+        "diagram_json = EXCLUDED.diagram_json, "
+        "diagram_json_compact = EXCLUDED.diagram_json_compact, "
+        "embedding = EXCLUDED.embedding, "
+        "updated_at = EXCLUDED.updated_at"
+    )
+    await db.commit()
+    _invalidate_search_cache()
+    logger.info("Bulk insert of %s diagrams successful", len(records))
+    return len(records)
+
 async def find_similar_diagrams(
     db: AsyncSession, 
     query_text: str, 
     limit: int = 5, 
     diagram_type: str = None,
-    include_scores: bool = False
-) -> List[DiagramEmbedding]:
+    include_scores: bool = False,
+    query_embedding: Optional[List[float]] = None
+) -> Union[List[DiagramEmbedding], List[Tuple[DiagramEmbedding, float]]]:
     """
     Find similar diagrams in the database using vector similarity search
-    
+
     Args:
         db: Database session
         query_text: The text to find similar diagrams for
         limit: Maximum number of results to return
         diagram_type: Optional filter by diagram type
         include_scores: Whether to include similarity scores in the output
-        
+        query_embedding: Optional precomputed embedding for query_text; when
+            provided the OpenAI embedding call is skipped entirely
+
     Returns:
-        List of similar diagrams, ordered by similarity
+        List of similar diagrams ordered by similarity; with include_scores
+        each entry is a (diagram, score) tuple
     """
-    print(f"\n==== VECTOR SEARCH DETAILS ====")
-    print(f"Database session: {db}")
-    print(f"Searching for diagrams similar to: {query_text[:100]}...")
-    print(f"Limit: {limit}, Diagram type filter: {diagram_type}, Include scores: {include_scores}")
-    
+    logger.debug("Vector search: query=%.100s... limit=%s type=%s include_scores=%s",
+                 query_text, limit, diagram_type, include_scores)
+
     try:
-        # First, let's check if we have any diagrams in the database at all
-        check_stmt = select(func.count(DiagramEmbedding.id))
-        check_result = await db.execute(check_stmt)
-        total_diagrams = check_result.scalar()
-        print(f"Total diagrams in database: {total_diagrams}")
-        
-        if total_diagrams == 0:
-            print("WARNING: No diagrams found in the database at all!")
-            return []
-        
-        # Generate embedding for the query text
-        query_embedding = await generate_embedding(query_text)
-        print(f"Generated embedding vector with {len(query_embedding)} dimensions")
+        # Check the in-process cache first - repeat queries skip both the
+        # OpenAI embedding call and the vector search entirely
+        cache_key = _search_cache_key(query_text, limit, diagram_type, include_scores)
+        async with _search_cache_lock:
+            cached = _search_cache.get(cache_key)
+        if cached is not None:
+            logger.debug("Search cache hit: re-fetching %s cached result IDs", len(cached))
+            return await _fetch_cached_diagrams(db, cached, include_scores)
+
+        if query_embedding is None:
+            query_embedding = await generate_embedding(query_text)
+
+        logger.debug("Query embedding has %s dimensions", len(query_embedding))
         
-        # Convert to numpy array for cosine similarity
-        query_vector = np.array(query_embedding)
+        # Pass the embedding list straight through - it is only ever bound as
+        # a query parameter, so the numpy conversion was pure overhead
+        query_vector = query_embedding
+
+        # Tune the HNSW candidate list for this transaction only
+        await db.execute(text(f"SET LOCAL hnsw.ef_search = {HNSW_EF_SEARCH}"))
         
+        # Build the distance expression once; it drives both the selected
+        # score column and the ordering
+        distance = DiagramEmbedding.embedding.cosine_distance(query_vector).label("similarity_score")
+
         # Start building the SQL query
         if include_scores:
-            # Include the cosine distance in the results
-            stmt = select(
-                DiagramEmbedding,
-                DiagramEmbedding.embedding.cosine_distance(query_vector).label("similarity_score")
-            )
+            # Include the cosine distance in the results. These callers (the
+            # RAG context path) also consume raw_text and the diagram JSON,
+            # so the full row is loaded.
+            stmt = select(DiagramEmbedding, distance)
         else:
-            stmt = select(DiagramEmbedding)
+            # Metadata-only callers never touch the embedding or diagram
+            # JSON; avoid materializing them row by row
+            stmt = select(DiagramEmbedding).options(_metadata_only())
         
-        # Add diagram type filter if provided
+        # Always apply the filter when diagram_type is provided - strict type
+        # isolation; an empty type simply yields an empty result set
         if diagram_type:
-            # Check how many diagrams match this type first
-            type_check_stmt = select(func.count(DiagramEmbedding.id)).filter(DiagramEmbedding.diagram_type == diagram_type)
-            type_check_result = await db.execute(type_check_stmt)
-            type_count = type_check_result.scalar()
-            print(f"Found {type_count} diagrams of type '{diagram_type}'")
-            
-            # Always apply the filter when diagram_type is provided - strict type isolation
             stmt = stmt.filter(DiagramEmbedding.diagram_type == diagram_type)
-            print(f"Applying strict filtering by diagram type: {diagram_type}")
-            
-            if type_count == 0:
-                print(f"No diagrams found with type '{diagram_type}', will return empty results to maintain type isolation")
         
         # Order by cosine similarity and limit results
         # This uses pgvector's cosine distance operator <-> for similarity search
-        stmt = stmt.order_by(
-            DiagramEmbedding.embedding.cosine_distance(query_vector)
-        ).limit(limit)
-        
-        print(f"Executing query: {stmt}")
+        stmt = stmt.order_by(distance).limit(limit)
+
         result = await db.execute(stmt)
-        
+
         if include_scores:
-            # Process results with scores
-            results_with_scores = result.all()
-            print(f"Query returned {len(results_with_scores)} results with scores")
-            
-            # Extract diagrams and scores
-            diagrams = []
-            for diagram, score in results_with_scores:
-                # Add score as an attribute to the diagram object
-                setattr(diagram, "similarity_score", score)
-                diagrams.append(diagram)
-                
-                # Log the score
-                print(f"Found diagram '{diagram.name}' (ID: {diagram.id}) with similarity score: {score:.4f}")
-            
-            return diagrams
+            # The score is computed in SQL; return (diagram, score) pairs
+            # instead of mutating ORM instances with setattr
+            scored_diagrams = list(result.all())
+            logger.debug("Query returned %s results with scores", len(scored_diagrams))
+
+            if logger.isEnabledFor(logging.DEBUG):
+                for diagram, score in scored_diagrams:
+                    logger.debug("Found diagram '%s' (ID: %s) with similarity score: %.4f",
+                                 diagram.name, diagram.id, score)
+
+            async with _search_cache_lock:
+                _search_cache[cache_key] = [(diagram.id, score) for diagram, score in scored_diagrams]
+
+            return scored_diagrams
         else:
             # Return just the diagrams without scores
             results = result.scalars().all()
-            print(f"Query returned {len(results)} results without scores")
-            
-            # Log found diagrams
-            for diagram in results:
-                print(f"Found diagram '{diagram.name}' (ID: {diagram.id})")
-                
+            logger.debug("Query returned %s results without scores", len(results))
+
+            if logger.isEnabledFor(logging.DEBUG):
+                for diagram in results:
+                    logger.debug("Found diagram '%s' (ID: %s)", diagram.name, diagram.id)
+
+            async with _search_cache_lock:
+                _search_cache[cache_key] = [(d.id, None) for d in results]
+
             return results
-    except Exception as e:
-        print(f"ERROR in vector search: {str(e)}")
-        import traceback
-        print(traceback.format_exc())
+    except Exception:
+        logger.exception("Error in vector search")
         return []
 
+# Cosine-distance ceiling for treating a cached response as a match for a
+# new query; 0.05 only fires on near-duplicate prompts
+SEMANTIC_CACHE_MAX_DISTANCE = 0.05
+SEMANTIC_CACHE_TTL_SECONDS = 86400
+
+
+async def lookup_cached_response(
+    db: AsyncSession,
+    query_embedding: List[float],
+    diagram_type: str
+) -> Optional[Dict[str, Any]]:
+    """
+    Return a cached generation response whose query embedding is nearly
+    identical to this one, or None. A hit is a single HNSW lookup instead of
+    a full LLM round-trip.
+    """
+    distance = DiagramResponseCache.embedding.cosine_distance(query_embedding)
+    stmt = (
+        select(DiagramResponseCache.response_json)
+        .filter(DiagramResponseCache.diagram_type == diagram_type)
+        .filter(DiagramResponseCache.expires_at > datetime.utcnow())
+        .filter(distance < SEMANTIC_CACHE_MAX_DISTANCE)
+        .order_by(distance)
+        .limit(1)
+    )
+    result = await db.execute(stmt)
+    return result.scalar_one_or_none()
+
+
+async def store_cached_response(
+    db: AsyncSession,
+    query_embedding: List[float],
+    diagram_type: str,
+    response_json: Dict[str, Any]
+) -> None:
+    """
+    Cache a successful generation response under its query embedding.
+    Expired entries for the same diagram type are pruned opportunistically.
+    """
+    await db.execute(
+        delete(DiagramResponseCache).filter(
+            DiagramResponseCache.diagram_type == diagram_type,
+            DiagramResponseCache.expires_at <= datetime.utcnow()
+        )
+    )
+    db.add(DiagramResponseCache(
+        diagram_type=diagram_type,
+        embedding=query_embedding,
+        response_json=response_json,
+        expires_at=datetime.utcnow() + timedelta(seconds=SEMANTIC_CACHE_TTL_SECONDS)
+    ))
+    await db.commit()
+
+
 async def get_template_by_type(db: AsyncSession, template_type: str) -> List[SysMLTemplate]:
     """
-    Retrieve all templates for a specific diagram type
+    Retrieve all templates for a specific diagram type.
+    The statement shape is fixed, so lambda_stmt caches its compiled SQL
+    across calls instead of rebuilding the expression tree every time.
     """
-    stmt = select(SysMLTemplate).filter(SysMLTemplate.template_type == template_type)
+    stmt = lambda_stmt(
+        lambda: select(SysMLTemplate).filter(SysMLTemplate.template_type == template_type)
+    )
     result = await db.execute(stmt)
     return result.scalars().all()
 
 async def get_components_by_type(db: AsyncSession, component_type: str) -> List[UAVComponent]:
     """
-    Retrieve all UAV components of a specific type
+    Retrieve all UAV components of a specific type.
+    Compiled once and cached via lambda_stmt, as with the template getter.
     """
-    stmt = select(UAVComponent).filter(UAVComponent.component_type == component_type)
+    stmt = lambda_stmt(
+        lambda: select(UAVComponent).filter(UAVComponent.component_type == component_type)
+    )
     result = await db.execute(stmt)
     return result.scalars().all()
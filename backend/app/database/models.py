@@ -1,8 +1,9 @@
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 from pydantic import BaseModel
-from sqlalchemy import Column, Integer, String, Text, JSON, DateTime, ForeignKey
-from pgvector.sqlalchemy import Vector
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy.dialects.postgresql import JSONB
+from pgvector.sqlalchemy import HALFVEC
 
 from app.db.base import Base
 
@@ -16,9 +17,29 @@ class DiagramEmbedding(Base):
     name = Column(String, nullable=False)
     description = Column(Text, nullable=True)
     raw_text = Column(Text, nullable=False)
-    diagram_type = Column(String, nullable=False)
-    diagram_json = Column(JSON, nullable=False)
-    embedding = Column(Vector(1536), nullable=True)  # OpenAI embedding dimension
+    # SHA-256 hex digest of raw_text; unique index so exact-match dedup
+    # lookups hit a fixed-size key and concurrent stores cannot race into
+    # duplicate rows
+    raw_text_hash = Column(String(64), nullable=True, unique=True, index=True)
+    diagram_type = Column(String, nullable=False, index=True)
+    diagram_json = Column(JSONB, nullable=False)
+    # Compact serialization of diagram_json, written once at store time so
+    # the RAG prompt builder never re-serializes the dict per request
+    diagram_json_compact = Column(Text, nullable=True)
+    # OpenAI embedding dimension, stored as half-precision floats to halve
+    # storage and memory bandwidth with negligible recall loss at 1536 dims
+    embedding = Column(HALFVEC(1536), nullable=True)
+
+class DiagramResponseCache(Base):
+    """Semantic cache of full generation responses, keyed by query embedding"""
+    __tablename__ = "diagram_response_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    diagram_type = Column(String, nullable=False, index=True)
+    embedding = Column(HALFVEC(1536), nullable=False)
+    response_json = Column(JSONB, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
 
 class SysMLTemplate(Base):
     __tablename__ = "sysml_templates"
@@ -28,7 +49,7 @@ class SysMLTemplate(Base):
     template_name = Column(String, nullable=False)
     template_description = Column(Text, nullable=True)
     template_type = Column(String, nullable=False)
-    template_json = Column(JSON, nullable=False)
+    template_json = Column(JSONB, nullable=False)
 
 class UAVComponent(Base):
     __tablename__ = "uav_components"
@@ -37,7 +58,7 @@ class UAVComponent(Base):
     component_name = Column(String, nullable=False)
     component_type = Column(String, nullable=False)
     component_description = Column(Text, nullable=True)
-    properties = Column(JSON, nullable=True)
+    properties = Column(JSONB, nullable=True)
 
 # Pydantic Models for API
 class DiagramEmbeddingCreate(BaseModel):
@@ -84,7 +105,15 @@ class SimilarDiagramRequest(BaseModel):
 
 class InternalBlockDiagram(Base):
     __tablename__ = "internal_block_diagrams"
-    
+    # One IBD per block within a parent diagram; also the conflict target
+    # for the bulk upsert
+    __table_args__ = (
+        UniqueConstraint(
+            "parent_bdd_diagram_id", "parent_block_id",
+            name="uq_internal_block_diagrams_parent_block"
+        ),
+    )
+
     id = Column(Integer, primary_key=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
@@ -95,8 +124,8 @@ class InternalBlockDiagram(Base):
     parent_block_id = Column(String, nullable=False, index=True)
     
     # The actual IBD data
-    nodes = Column(JSON, nullable=False)
-    edges = Column(JSON, nullable=False)
+    nodes = Column(JSONB, nullable=False)
+    edges = Column(JSONB, nullable=False)
     
     # To track if it was created by AI or manually (e.g., 'ai' or 'manual')
     source = Column(String, default='ai', nullable=False)
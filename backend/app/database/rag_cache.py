@@ -0,0 +1,112 @@
+"""
+In-process semantic cache for RAG context lookups.
+
+Repeated or near-identical prompts (UI retries, demos, tests) would
+otherwise re-run the pgvector KNN query for the same one-shot example.
+Cached query embeddings are kept L2-normalized in one dense float32
+matrix, so a lookup is a single BLAS matrix-vector product followed by
+an argsort - microseconds against thousands of cached entries.
+"""
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+class SemanticQueryCache:
+    """
+    Similarity cache keyed by (diagram_type, query embedding).
+
+    A lookup hits when a cached query of the same diagram type has cosine
+    similarity >= threshold, has not expired, and was stored under the
+    current generation for that type. Stores bump the generation via
+    invalidate(), so stale context can never be served after new diagrams
+    are ingested.
+    """
+
+    def __init__(self, max_size: int = 2000, ttl: float = 600.0, threshold: float = 0.97):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._threshold = threshold
+        self._lock = threading.RLock()
+        # (N, D) float32 matrix of unit-norm query vectors; rows parallel
+        # to _entries
+        self._vecs: Optional[np.ndarray] = None
+        self._entries: List[Dict[str, Any]] = []
+        self._generations: Dict[str, int] = {}
+
+    def _generation(self, diagram_type: str) -> int:
+        return self._generations.get(diagram_type, 0)
+
+    def invalidate(self, diagram_type: Optional[str] = None) -> None:
+        """Invalidate cached results for one diagram type, or all of them"""
+        with self._lock:
+            if diagram_type is None:
+                self._vecs = None
+                self._entries = []
+                self._generations = {}
+            else:
+                self._generations[diagram_type] = self._generation(diagram_type) + 1
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> Optional[np.ndarray]:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        if norm == 0:
+            return None
+        return vec / norm
+
+    def get(self, diagram_type: str, embedding: List[float]) -> Optional[Any]:
+        """Return the cached payload for a semantically equivalent query, or None"""
+        with self._lock:
+            if self._vecs is None or not self._entries:
+                return None
+            query = self._normalize(embedding)
+            if query is None:
+                return None
+
+            sims = self._vecs @ query
+            now = time.monotonic()
+            generation = self._generation(diagram_type)
+            # Walk candidates best-first; anything below the threshold ends
+            # the search
+            for i in np.argsort(sims)[::-1]:
+                if sims[i] < self._threshold:
+                    break
+                entry = self._entries[i]
+                if entry["diagram_type"] != diagram_type:
+                    continue
+                if entry["generation"] != generation:
+                    continue
+                if now - entry["created"] > self._ttl:
+                    continue
+                entry["last_used"] = now
+                return entry["payload"]
+            return None
+
+    def put(self, diagram_type: str, embedding: List[float], payload: Any) -> None:
+        """Cache a payload under its query embedding"""
+        with self._lock:
+            query = self._normalize(embedding)
+            if query is None:
+                return
+            row = query[np.newaxis, :]
+            self._vecs = row if self._vecs is None else np.vstack([self._vecs, row])
+            now = time.monotonic()
+            self._entries.append({
+                "diagram_type": diagram_type,
+                "generation": self._generation(diagram_type),
+                "created": now,
+                "last_used": now,
+                "payload": payload,
+            })
+            if len(self._entries) > self._max_size:
+                # Evict the least recently used entry
+                lru = min(range(len(self._entries)), key=lambda i: self._entries[i]["last_used"])
+                self._vecs = np.delete(self._vecs, lru, axis=0)
+                del self._entries[lru]
+
+
+# Shared cache of one-shot RAG examples keyed by query embedding
+rag_context_cache = SemanticQueryCache()
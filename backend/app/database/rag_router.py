@@ -1,28 +1,81 @@
 from fastapi import APIRouter, Depends, HTTPException, Body
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Dict, Any
-import json
+import asyncio
+import hashlib
+import logging
 
-from app.db.dependencies import get_db
+from cachetools import TTLCache
+
+from app.core.config import settings
+from app.db.dependencies import get_db, get_ro_db
 from app.database.models import (
     DiagramEmbeddingCreate, 
     DiagramEmbeddingResponse, 
     TemplateResponse,
     ComponentResponse, 
-    SimilarDiagramRequest,
-    InternalBlockDiagramCreate
+    SimilarDiagramRequest
 )
 from app.database.embeddings import (
-    store_diagram_with_embedding, 
+    store_diagram_with_embedding,
+    bulk_store_diagrams,
     find_similar_diagrams,
+    generate_embedding,
+    lookup_cached_response,
+    store_cached_response,
     get_template_by_type,
     get_components_by_type
 )
-from app.AI.diagram_generation import generate_diagram, generate_sysml_diagram, DiagramPositioning
+from app.database.rag_cache import rag_context_cache
+from app.AI.diagram_generation import (
+    generate_diagram,
+    generate_sysml_diagram,
+    extract_internal_diagrams,
+    DiagramPositioning
+)
 from app.crud import crud_ibd
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/rag", tags=["RAG"])
 
+# TEMPORARY: Bootstrap example with connected IBD components for better AI
+# training. Built once at import time and treated as read-only - nothing
+# downstream mutates one-shot examples, so every request can share it.
+_BOOTSTRAP_EXAMPLE_BDD_ENHANCED = {
+    "input": "Create a UAV flight controller with CPU and memory connected internally, plus GPS sensor",
+    "output": {
+        "diagram_type": "bdd",
+        "elements": [
+            {
+                "id": "flight-controller",
+                "type": "block",
+                "name": "Flight Controller",
+                "internal_diagram": {
+                    "nodes": [
+                        {"id": "cpu-unit", "type": "ibd_block", "name": "Central Processing Unit"},
+                        {"id": "memory-unit", "type": "ibd_block", "name": "Memory Module"},
+                        {"id": "io-unit", "type": "ibd_block", "name": "I/O Controller"}
+                    ],
+                    "edges": [
+                        {"id": "cpu-memory-bus", "source": "cpu-unit", "target": "memory-unit", "label": "Data Bus"},
+                        {"id": "cpu-io-control", "source": "cpu-unit", "target": "io-unit", "label": "Control Signals"},
+                        {"id": "memory-io-access", "source": "memory-unit", "target": "io-unit", "label": "Memory Access"}
+                    ]
+                }
+            },
+            {
+                "id": "gps-sensor",
+                "type": "sensor",
+                "name": "GPS"
+            }
+        ],
+        "relationships": [
+            {"source_id": "gps-sensor", "target_id": "flight-controller", "name": "Provides data"}
+        ]
+    }
+}
+
 @router.post("/diagrams/", response_model=DiagramEmbeddingResponse)
 async def create_diagram_embedding(
     diagram: DiagramEmbeddingCreate,
@@ -41,6 +94,20 @@ async def create_diagram_embedding(
     )
     return db_diagram
 
+@router.post("/diagrams/bulk/")
+async def bulk_create_diagram_embeddings(
+    diagrams: List[DiagramEmbeddingCreate],
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Bulk-ingest diagrams in a single COPY stream instead of per-row inserts
+    """
+    inserted = await bulk_store_diagrams(
+        db=db,
+        diagrams=[diagram.model_dump() for diagram in diagrams]
+    )
+    return {"inserted": inserted}
+
 @router.post("/similar-diagrams/", response_model=List[DiagramEmbeddingResponse])
 async def find_similar_diagrams_endpoint(
     request: SimilarDiagramRequest,
@@ -60,7 +127,7 @@ async def find_similar_diagrams_endpoint(
 @router.get("/templates/{template_type}", response_model=List[TemplateResponse])
 async def get_templates(
     template_type: str,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_ro_db)
 ):
     """
     Get all templates for a specific diagram type
@@ -71,7 +138,7 @@ async def get_templates(
 @router.get("/components/{component_type}", response_model=List[ComponentResponse])
 async def get_components(
     component_type: str,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_ro_db)
 ):
     """
     Get all UAV components of a specific type
@@ -79,191 +146,268 @@ async def get_components(
     components = await get_components_by_type(db, component_type)
     return components
 
+# Exact-match result cache: byte-identical (model, type, text) requests
+# within the TTL return the full previous response without touching OpenAI
+# or the database. Near-duplicates are handled by the semantic layers.
+_result_cache: TTLCache = TTLCache(maxsize=512, ttl=3600)
+
+
+def _result_cache_key(diagram_type: str, text: str) -> str:
+    """Cache key for a generation request; includes the model so results
+    are invalidated when the configured model changes"""
+    raw = f"{settings.OPENAI_GENERATIVE_MODEL}|{diagram_type}|{text}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+async def _fetch_rag_example(
+    db: AsyncSession,
+    text: str,
+    search_type: str,
+    query_embedding
+):
+    """
+    Retrieve the best-match one-shot example for a query, or None.
+    Checks the in-process semantic query cache before hitting pgvector;
+    retrieval failures are logged and treated as "no example".
+    """
+    try:
+        # Near-identical prompts reuse the previously retrieved one-shot
+        # example without touching pgvector; the cache is invalidated
+        # whenever new diagrams are stored
+        if query_embedding is not None:
+            cached_example = rag_context_cache.get(search_type, query_embedding)
+            if cached_example is not None:
+                logger.debug("Semantic query cache hit for RAG context (type=%s)", search_type)
+                return cached_example
+
+        similar_diagrams = await find_similar_diagrams(
+            db=db,
+            query_text=text,
+            limit=1,
+            diagram_type=search_type,
+            include_scores=True,
+            query_embedding=query_embedding
+        )
+
+        if not similar_diagrams:
+            logger.debug("No diagrams of type '%s' found, proceeding without RAG context", search_type)
+            return None
+
+        best_match, similarity_score = similar_diagrams[0]
+        logger.debug("Found best match: %s (type: %s) with similarity score: %.4f",
+                     best_match.name, best_match.diagram_type, similarity_score)
+
+        # Always use the best match regardless of score. Prefer the compact
+        # string precomputed at store time so the example is not
+        # re-serialized on every request.
+        example = {
+            "input": best_match.raw_text,
+            "output": best_match.diagram_json_compact or best_match.diagram_json
+        }
+        if query_embedding is not None:
+            rag_context_cache.put(search_type, query_embedding, example)
+        return example
+    except Exception:
+        logger.exception("Error during RAG context retrieval")
+        return None
+
+
+async def _persist_and_respond(
+    db: AsyncSession,
+    text: str,
+    name: str,
+    diagram_type: str,
+    positioned_diagram: Dict[str, Any],
+    generation_result: Dict[str, Any],
+    one_shot_examples: List[Dict[str, Any]],
+    used_rag: bool,
+    query_embedding,
+    ibd_to_create: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """Store the generated diagram (and any IBDs), then build the response"""
+    db_diagram = await store_diagram_with_embedding(
+        db=db,
+        name=name,
+        description=f"Generated {diagram_type} diagram",
+        raw_text=text,
+        diagram_type="bdd",  # Always save as 'bdd' for RAG consistency
+        diagram_json=positioned_diagram,
+        # raw_text is the query text embedded at the top of the route,
+        # so the store is a pure database write
+        precomputed_embedding=query_embedding
+    )
+
+    if ibd_to_create:
+        # One multi-row upsert replaces the old per-block check-then-write loop
+        ibd_ids = await crud_ibd.bulk_upsert_ibds(
+            db=db,
+            parent_bdd_id=db_diagram.id,
+            ibds=ibd_to_create
+        )
+        logger.debug("Upserted %s IBDs for diagram %s", len(ibd_ids), db_diagram.id)
+
+    result = {
+        "diagram": positioned_diagram,
+        "raw_text": text,
+        "model_used": generation_result["model_used"],
+        "saved_to_rag": True,
+        "used_rag": used_rag,
+        "examples_count": len(one_shot_examples),
+        "diagram_id": db_diagram.id
+    }
+
+    if query_embedding is not None:
+        try:
+            await store_cached_response(db, query_embedding, diagram_type, result)
+        except Exception:
+            logger.exception("Semantic response cache store failed")
+
+    return result
+
+
+async def _generate_bdd(
+    db: AsyncSession,
+    text: str,
+    name: str,
+    diagram_type: str,
+    use_rag: bool,
+    query_embedding
+) -> Dict[str, Any]:
+    """Plain diagram generation - straight-line path with no IBD handling"""
+    one_shot_examples = []
+    if use_rag:
+        example = await _fetch_rag_example(db, text, diagram_type, query_embedding)
+        if example is not None:
+            one_shot_examples.append(example)
+
+    # The generator blocks on the OpenAI chat call, so run it off the event
+    # loop - otherwise one generation serializes every other request on
+    # this worker for the duration of the LLM round-trip
+    generation_result = await asyncio.to_thread(
+        generate_sysml_diagram,
+        prompt=text,
+        diagram_type=diagram_type,
+        one_shot_examples=one_shot_examples
+    )
+    if "error" in generation_result:
+        return {"error": generation_result["error"]}
+
+    positioned_diagram = DiagramPositioning.apply_positioning(generation_result["diagram_raw"])
+    return await _persist_and_respond(
+        db,
+        text=text,
+        name=name,
+        diagram_type=diagram_type,
+        positioned_diagram=positioned_diagram,
+        generation_result=generation_result,
+        one_shot_examples=one_shot_examples,
+        used_rag=use_rag and len(one_shot_examples) > 0,
+        query_embedding=query_embedding,
+        ibd_to_create=[]
+    )
+
+
+async def _generate_bdd_enhanced(
+    db: AsyncSession,
+    text: str,
+    name: str,
+    use_rag: bool,
+    query_embedding
+) -> Dict[str, Any]:
+    """Enhanced diagram generation with bootstrap example and IBD parsing"""
+    one_shot_examples = [_BOOTSTRAP_EXAMPLE_BDD_ENHANCED]
+    if use_rag:
+        # Enhanced diagrams search plain bdd examples as well
+        example = await _fetch_rag_example(db, text, "bdd", query_embedding)
+        if example is not None:
+            one_shot_examples.append(example)
+
+    generation_result = await asyncio.to_thread(
+        generate_sysml_diagram,
+        prompt=text,
+        diagram_type="bdd_enhanced",
+        one_shot_examples=one_shot_examples
+    )
+    if "error" in generation_result:
+        return {"error": generation_result["error"]}
+
+    raw_diagram, ibd_to_create = extract_internal_diagrams(generation_result["diagram_raw"])
+
+    if logger.isEnabledFor(logging.DEBUG):
+        for ibd_data in ibd_to_create:
+            logger.debug("IBD for block %s has %s edges in AI response",
+                         ibd_data["parent_block_id"], len(ibd_data["edges"]))
+
+    positioned_diagram = DiagramPositioning.apply_positioning(raw_diagram)
+    return await _persist_and_respond(
+        db,
+        text=text,
+        name=name,
+        diagram_type="bdd_enhanced",
+        positioned_diagram=positioned_diagram,
+        generation_result=generation_result,
+        one_shot_examples=one_shot_examples,
+        used_rag=use_rag and len(one_shot_examples) > 0,
+        query_embedding=query_embedding,
+        ibd_to_create=ibd_to_create
+    )
+
+
 @router.post("/generate-diagram-with-context/")
 async def generate_diagram_with_context(
     text: str = Body(..., embed=True),
     diagram_type: str = Body("bdd", embed=True),
     use_rag: bool = Body(True, embed=True),
     name: str = Body("Generated Diagram", embed=True),
+    no_cache: bool = Body(False, embed=True),
     db: AsyncSession = Depends(get_db)
 ):
     """
     Generate a diagram using context from the database if use_rag is True.
     Supports both 'bdd' and 'bdd_enhanced' diagram types with full IBD parsing.
+
+    Semantically equivalent requests (near-identical query embeddings) are
+    served from the response cache unless no_cache is set. Dispatches to a
+    specialized handler per diagram type so the common plain-bdd path never
+    executes IBD or bootstrap-example code.
     """
-    one_shot_examples = []
-    
-    print(f"\n==== Generating {diagram_type} diagram with RAG: {use_rag} ====")
-    print(f"Input text: {text[:100]}...")
-    
-    # TEMPORARY: Bootstrap example with connected IBD components for better AI training
-    if diagram_type == "bdd_enhanced":
-        bootstrap_example = {
-            "input": "Create a UAV flight controller with CPU and memory connected internally, plus GPS sensor",
-            "output": {
-                "diagram_type": "bdd",
-                "elements": [
-                    {
-                        "id": "flight-controller",
-                        "type": "block", 
-                        "name": "Flight Controller",
-                        "internal_diagram": {
-                            "nodes": [
-                                {"id": "cpu-unit", "type": "ibd_block", "name": "Central Processing Unit"},
-                                {"id": "memory-unit", "type": "ibd_block", "name": "Memory Module"},
-                                {"id": "io-unit", "type": "ibd_block", "name": "I/O Controller"}
-                            ],
-                            "edges": [
-                                {"id": "cpu-memory-bus", "source": "cpu-unit", "target": "memory-unit", "label": "Data Bus"},
-                                {"id": "cpu-io-control", "source": "cpu-unit", "target": "io-unit", "label": "Control Signals"},
-                                {"id": "memory-io-access", "source": "memory-unit", "target": "io-unit", "label": "Memory Access"}
-                            ]
-                        }
-                    },
-                    {
-                        "id": "gps-sensor",
-                        "type": "sensor",
-                        "name": "GPS"
-                    }
-                ],
-                "relationships": [
-                    {"source_id": "gps-sensor", "target_id": "flight-controller", "name": "Provides data"}
-                ]
-            }
-        }
-        one_shot_examples.append(bootstrap_example)
-        print(f"Added bootstrap example with {len(bootstrap_example['output']['elements'][0]['internal_diagram']['edges'])} connected IBD edges")
-    
-    if use_rag:
-        try:
-            # For enhanced diagrams, search for both bdd and bdd_enhanced examples
-            search_type = diagram_type if diagram_type != "bdd_enhanced" else "bdd"
-            similar_diagrams = await find_similar_diagrams(
-                db=db, 
-                query_text=text, 
-                limit=1,  
-                diagram_type=search_type,
-                include_scores=True
-            )
-            
-            if not similar_diagrams:
-                print(f"No diagrams of type '{search_type}' found, will proceed without RAG context")
-            
-            if similar_diagrams:
-                best_match = similar_diagrams[0]
-                similarity_score = getattr(best_match, "similarity_score", None)
-                
-                print(f"Found best match: {best_match.name} (type: {best_match.diagram_type}) with similarity score: {similarity_score:.4f}")
-                
-                # Always use the best match regardless of score
-                one_shot_examples.append({
-                    "input": best_match.raw_text,
-                    "output": best_match.diagram_json
-                })
-                
-                print(f"Using one-shot example with {len(best_match.raw_text)} chars of text and {len(json.dumps(best_match.diagram_json))} chars of JSON")
-            else:
-                print("No similar diagrams found for RAG context at all")
-                
-        except Exception as e:
-            print(f"Error during RAG context retrieval: {str(e)}")
-            use_rag = False
-    
+    logger.debug("Generating %s diagram with RAG=%s, input text: %.100s...", diagram_type, use_rag, text)
+
+    # Byte-identical repeat requests cost one hash + dict lookup
+    result_key = _result_cache_key(diagram_type, text)
+    if not no_cache:
+        cached_result = _result_cache.get(result_key)
+        if cached_result is not None:
+            logger.info("Exact result cache hit for %s query", diagram_type)
+            return {**cached_result, "from_cache": True}
+
+    # Embed the query once up front; it is reused for the semantic response
+    # cache lookup, the RAG similarity search, and the final store
+    query_embedding = None
     try:
-        # Use the new generation function that supports enhanced diagrams
-        generation_result = generate_sysml_diagram(
-            prompt=text,
-            diagram_type=diagram_type,
-            one_shot_examples=one_shot_examples
-        )
-        
-        if "error" in generation_result:
-            return {"error": generation_result["error"]}
-        
-        raw_diagram = generation_result["diagram_raw"]
-        
-        # Handle enhanced diagrams with IBD parsing
-        ibd_to_create = []
-        if diagram_type == "bdd_enhanced" and "elements" in raw_diagram:
-            for element in raw_diagram["elements"]:
-                if "internal_diagram" in element:
-                    # Mark the element as having an IBD for the frontend
-                    if "data" not in element:
-                        element["data"] = {}
-                    element["data"]["has_ibd"] = True
-                    
-                    # Prepare IBD for creation later
-                    ibd_data = element.pop("internal_diagram")  # Remove IBD from main diagram
-                    
-                    # DEBUG: Log what edges were found in the AI response
-                    edges_found = ibd_data.get("edges", [])
-                    print(f"DEBUG: IBD for block {element['id']} has {len(edges_found)} edges in AI response")
-                    if edges_found:
-                        print(f"DEBUG: Edges content: {edges_found}")
-                    else:
-                        print(f"DEBUG: No edges found in internal_diagram for {element['id']}")
-                    
-                    ibd_to_create.append({
-                        "parent_block_id": element["id"],
-                        "nodes": ibd_data.get("nodes", []),
-                        "edges": edges_found,
-                    })
-        
-        # Apply positioning to the clean diagram
-        positioned_diagram = DiagramPositioning.apply_positioning(raw_diagram)
-        
-        # Save the main diagram to get its ID
-        db_diagram = await store_diagram_with_embedding(
-            db=db,
-            name=name,
-            description=f"Generated {diagram_type} diagram",
-            raw_text=text,
-            diagram_type="bdd",  # Always save as 'bdd' for RAG consistency
-            diagram_json=positioned_diagram
-        )
-        
-        # Save parsed IBDs with the parent BDD ID - New Upsert Logic
-        for ibd_data in ibd_to_create:
-            existing_ibd = await crud_ibd.get_ibd_by_parent_and_block(
-                db=db,
-                parent_bdd_id=db_diagram.id,
-                block_id=ibd_data["parent_block_id"]
-            )
+        query_embedding = await generate_embedding(text)
+        if not no_cache:
+            cached_response = await lookup_cached_response(db, query_embedding, diagram_type)
+            if cached_response is not None:
+                logger.info("Semantic cache hit for %s query, skipping generation", diagram_type)
+                return {**cached_response, "from_cache": True}
+    except Exception:
+        # Cache problems must never block generation
+        logger.exception("Semantic response cache lookup failed")
 
-            if existing_ibd:
-                # IBD already exists -> UPDATE it
-                print(f"DEBUG: Found existing IBD for block {ibd_data['parent_block_id']}. Updating...")
-                await crud_ibd.update_ibd(
-                    db=db,
-                    db_ibd=existing_ibd,
-                    nodes=ibd_data["nodes"],
-                    edges=ibd_data["edges"]
-                )
-            else:
-                # IBD does not exist -> CREATE it
-                print(f"DEBUG: No existing IBD for block {ibd_data['parent_block_id']}. Creating new...")
-                new_ibd = InternalBlockDiagramCreate(
-                    parent_bdd_diagram_id=db_diagram.id,
-                    parent_block_id=ibd_data["parent_block_id"],
-                    nodes=ibd_data["nodes"],
-                    edges=ibd_data["edges"],
-                    source="ai"
-                )
-                await crud_ibd.create_ibd(db=db, ibd=new_ibd)
-        
-        # Return in the expected format
-        result = {
-            "diagram": positioned_diagram,
-            "raw_text": text,
-            "model_used": generation_result["model_used"],
-            "saved_to_rag": True,
-            "used_rag": use_rag and len(one_shot_examples) > 0,
-            "examples_count": len(one_shot_examples),
-            "diagram_id": db_diagram.id
-        }
-        
+    try:
+        if diagram_type == "bdd_enhanced":
+            result = await _generate_bdd_enhanced(
+                db, text=text, name=name, use_rag=use_rag, query_embedding=query_embedding
+            )
+        else:
+            result = await _generate_bdd(
+                db, text=text, name=name, diagram_type=diagram_type,
+                use_rag=use_rag, query_embedding=query_embedding
+            )
+        if "error" not in result:
+            _result_cache[result_key] = result
         return result
-        
     except Exception as e:
-        print(f"Error in unified RAG generation: {str(e)}")
+        logger.exception("Error in unified RAG generation")
         return {"error": str(e)}
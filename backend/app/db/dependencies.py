@@ -3,7 +3,7 @@ from typing import AsyncGenerator
 from fastapi import Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.session import AsyncSessionLocal
+from app.db.session import AsyncSessionLocal, AsyncReadOnlySessionLocal
 
 
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
@@ -12,3 +12,15 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
         yield db
     finally:
         await db.close()
+
+
+async def get_ro_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Autocommit session for read-only endpoints; skips the BEGIN/COMMIT
+    round-trips that plain SELECTs don't need
+    """
+    db = AsyncReadOnlySessionLocal()
+    try:
+        yield db
+    finally:
+        await db.close()
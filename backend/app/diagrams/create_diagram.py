@@ -1,19 +1,42 @@
-from fastapi import APIRouter, Body, HTTPException, Depends
-from app.AI.diagram_generation import generate_diagram, generate_sysml_diagram, DiagramPositioning
+import asyncio
+
+import msgspec
+import orjson
+from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from app.AI.diagram_generation import (
+    generate_diagram,
+    generate_sysml_diagram,
+    extract_internal_diagrams,
+    DiagramPositioning,
+)
 from app.crud import crud_ibd
-from app.database.models import InternalBlockDiagramCreate
 from app.database.embeddings import store_diagram_with_embedding
 from app.db.dependencies import get_db
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Dict, Any
 from pydantic import BaseModel
 
-router = APIRouter(prefix="/create-diagram", tags=["Create Diagram"])
+# orjson-encode the large diagram payloads regardless of app-level defaults
+router = APIRouter(
+    prefix="/create-diagram",
+    tags=["Create Diagram"],
+    default_response_class=ORJSONResponse
+)
 
-class DiagramRequest(BaseModel):
+class DiagramRequest(msgspec.Struct):
     text: str
     diagram_type: str = "bdd"  # "bdd" or "bdd_enhanced"
     name: str = "Generated Diagram"
+    stream: bool = False  # Return the diagram as NDJSON instead of one JSON body
+
+
+async def parse_diagram_request(http_request: Request) -> DiagramRequest:
+    """Decode the request body with msgspec, which validates the struct in C."""
+    try:
+        return msgspec.json.decode(await http_request.body(), type=DiagramRequest)
+    except msgspec.DecodeError as e:
+        raise HTTPException(status_code=422, detail=str(e))
 
 class DiagramResponse(BaseModel):
     diagram: Dict[str, Any]
@@ -22,9 +45,46 @@ class DiagramResponse(BaseModel):
     error: str = None
     diagram_id: int = None
 
-@router.post("/", response_model=DiagramResponse)
+def _ndjson_stream(positioned_diagram, raw_text: str, model_used: str, diagram_id: int):
+    """
+    Yield the diagram as NDJSON lines: metadata first, then one line per
+    element and relationship, then a footer with the stored diagram ID.
+    Clients can render elements as they arrive instead of waiting for the
+    full body.
+    """
+    meta = {
+        key: value for key, value in positioned_diagram.items()
+        if key not in ("elements", "relationships")
+    }
+    yield orjson.dumps({
+        "diagram_meta": meta,
+        "raw_text": raw_text,
+        "model_used": model_used,
+    }) + b"\n"
+    for element in positioned_diagram.get("elements", []):
+        yield orjson.dumps({"element": element}) + b"\n"
+    for relationship in positioned_diagram.get("relationships", []):
+        yield orjson.dumps({"relationship": relationship}) + b"\n"
+    yield orjson.dumps({"diagram_id": diagram_id}) + b"\n"
+
+
+# DiagramResponse is kept for the OpenAPI schema only; returning a plain dict
+# skips FastAPI's second validation/serialization pass over the large payload.
+# The request body is decoded by msgspec, so its schema is supplied explicitly.
+@router.post(
+    "/",
+    responses={200: {"model": DiagramResponse}},
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": msgspec.json.schema(DiagramRequest)}
+            },
+        }
+    },
+)
 async def create_diagram_endpoint(
-    request: DiagramRequest = Body(...), 
+    request: DiagramRequest = Depends(parse_diagram_request),
     db: AsyncSession = Depends(get_db)
 ):
     """
@@ -39,8 +99,10 @@ async def create_diagram_endpoint(
         The generated diagram structure and metadata
     """
     try:
-        # 1. Call the new generation function
-        generation_result = generate_sysml_diagram(
+        # 1. Call the new generation function in a worker thread so the
+        # synchronous OpenAI call doesn't block the event loop
+        generation_result = await asyncio.to_thread(
+            generate_sysml_diagram,
             prompt=request.text,
             diagram_type=request.diagram_type,
             one_shot_examples=[]  # TODO: Add RAG logic here if needed
@@ -51,26 +113,11 @@ async def create_diagram_endpoint(
         
         raw_diagram = generation_result["diagram_raw"]
         
-        # 2. Parse for IBDs and prepare the main diagram
-        ibd_to_create = []
-        if "elements" in raw_diagram:
-            for element in raw_diagram["elements"]:
-                if "internal_diagram" in element:
-                    # Mark the element as having an IBD for the frontend
-                    if "data" not in element:
-                        element["data"] = {}
-                    element["data"]["has_ibd"] = True
-                    
-                    # Prepare IBD for creation later
-                    ibd_data = element.pop("internal_diagram")  # Remove IBD from main diagram
-                    ibd_to_create.append({
-                        "parent_block_id": element["id"],
-                        "nodes": ibd_data.get("nodes", []),
-                        "edges": ibd_data.get("edges", []),
-                    })
-        
+        # 2. Split out the embedded IBDs without mutating the raw diagram
+        cleaned_diagram, ibd_to_create = extract_internal_diagrams(raw_diagram)
+
         # 3. Apply positioning to the now-clean BDD data
-        positioned_diagram = DiagramPositioning.apply_positioning(raw_diagram)
+        positioned_diagram = DiagramPositioning.apply_positioning(cleaned_diagram)
         
         # 4. Save the main BDD diagram to get its ID
         db_diagram = await store_diagram_with_embedding(
@@ -82,42 +129,33 @@ async def create_diagram_endpoint(
             diagram_json=positioned_diagram  # Save the positioned, clean diagram
         )
         
-        # 5. Save the parsed IBDs with the parent BDD ID - New Upsert Logic
-        for ibd_data in ibd_to_create:
-            existing_ibd = await crud_ibd.get_ibd_by_parent_and_block(
+        # 5. Save the parsed IBDs with the parent BDD ID in one round-trip
+        if ibd_to_create:
+            await crud_ibd.bulk_upsert_ibds(
                 db=db,
                 parent_bdd_id=db_diagram.id,
-                block_id=ibd_data["parent_block_id"]
+                ibds=ibd_to_create
             )
-
-            if existing_ibd:
-                # IBD already exists -> UPDATE it
-                print(f"DEBUG: Found existing IBD for block {ibd_data['parent_block_id']}. Updating...")
-                await crud_ibd.update_ibd(
-                    db=db,
-                    db_ibd=existing_ibd,
-                    nodes=ibd_data["nodes"],
-                    edges=ibd_data["edges"]
-                )
-            else:
-                # IBD does not exist -> CREATE it
-                print(f"DEBUG: No existing IBD for block {ibd_data['parent_block_id']}. Creating new...")
-                new_ibd = InternalBlockDiagramCreate(
-                    parent_bdd_diagram_id=db_diagram.id,
-                    parent_block_id=ibd_data["parent_block_id"],
-                    nodes=ibd_data["nodes"],
-                    edges=ibd_data["edges"],
-                    source="ai"
-                )
-                await crud_ibd.create_ibd(db=db, ibd=new_ibd)
         
-        # Return the response in the expected DiagramResponse format
-        return DiagramResponse(
-            diagram=positioned_diagram,
-            raw_text=request.text,
-            model_used=generation_result["model_used"],
-            diagram_id=db_diagram.id
-        )
+        if request.stream:
+            return StreamingResponse(
+                _ndjson_stream(
+                    positioned_diagram,
+                    raw_text=request.text,
+                    model_used=generation_result["model_used"],
+                    diagram_id=db_diagram.id,
+                ),
+                media_type="application/x-ndjson",
+            )
+
+        # Return the response in the DiagramResponse shape without revalidating it
+        return {
+            "diagram": positioned_diagram,
+            "raw_text": request.text,
+            "model_used": generation_result["model_used"],
+            "error": None,
+            "diagram_id": db_diagram.id,
+        }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating diagram: {str(e)}")
@@ -1,13 +1,41 @@
+from functools import lru_cache
+
+import orjson
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.crud import crud_ibd
 from app.database.models import InternalBlockDiagramResponse
 from app.db.dependencies import get_db
 from app.AI.diagram_generation import DiagramPositioning
 
-router = APIRouter(prefix="/diagrams", tags=["IBD Diagrams"])
+# orjson-encode the IBD payloads regardless of app-level defaults
+router = APIRouter(
+    prefix="/diagrams",
+    tags=["IBD Diagrams"],
+    default_response_class=ORJSONResponse
+)
+
+@lru_cache(maxsize=1024)
+def _positioned_ibd_cached(nodes_json: bytes) -> dict:
+    """
+    Run the Dagre layout once per distinct node set.
 
-@router.get("/ibd/{parent_block_id}", response_model=InternalBlockDiagramResponse)
+    The orjson fingerprint of the nodes doubles as cache key and payload,
+    so stale entries are impossible: any change to the stored nodes yields
+    a new key and a fresh layout pass.
+    """
+    ibd_diagram_data = {
+        "diagram_type": "ibd",
+        "elements": orjson.loads(nodes_json),
+        "relationships": []  # IBD doesn't use relationships, only edges
+    }
+    return DiagramPositioning.apply_positioning(ibd_diagram_data)
+
+
+# InternalBlockDiagramResponse is kept for the OpenAPI schema only; returning a
+# plain dict avoids the nested-model cloning and per-request revalidation
+@router.get("/ibd/{parent_block_id}", responses={200: {"model": InternalBlockDiagramResponse}})
 async def read_ibd_by_block_id(
     parent_block_id: str, 
     db: AsyncSession = Depends(get_db)
@@ -26,23 +54,17 @@ async def read_ibd_by_block_id(
     if db_ibd is None:
         raise HTTPException(status_code=404, detail="Internal Block Diagram not found")
     
-    # Apply positioning to the IBD nodes only (edges don't need positioning)
-    ibd_diagram_data = {
-        "diagram_type": "ibd", 
-        "elements": db_ibd.nodes,
-        "relationships": []  # IBD doesn't use relationships, only edges
-    }
-    positioned_ibd = DiagramPositioning.apply_positioning(ibd_diagram_data)
-    
-    # Update the response with positioned data
-    response_data = InternalBlockDiagramResponse(
-        id=db_ibd.id,
-        parent_bdd_diagram_id=db_ibd.parent_bdd_diagram_id,
-        parent_block_id=db_ibd.parent_block_id,
-        nodes=positioned_ibd.get("elements", []),
-        edges=db_ibd.edges,  # Use edges directly from database
-        source=db_ibd.source,
-        created_at=db_ibd.created_at
-    )
+    # Apply positioning to the IBD nodes only (edges don't need positioning);
+    # repeat reads of an unchanged IBD reuse the cached layout
+    positioned_ibd = _positioned_ibd_cached(orjson.dumps(db_ibd.nodes))
     
-    return response_data
\ No newline at end of file
+    # Return the response in the InternalBlockDiagramResponse shape without revalidating it
+    return {
+        "id": db_ibd.id,
+        "parent_bdd_diagram_id": db_ibd.parent_bdd_diagram_id,
+        "parent_block_id": db_ibd.parent_block_id,
+        "nodes": positioned_ibd.get("elements", []),
+        "edges": db_ibd.edges,  # Use edges directly from database
+        "source": db_ibd.source,
+        "created_at": db_ibd.created_at,  # orjson serializes datetimes natively
+    }
\ No newline at end of file
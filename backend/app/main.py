@@ -1,32 +1,60 @@
+import uvloop
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+
+# Use uvloop for every entry point, not just launches that pass --loop uvloop
+uvloop.install()
 from app.api.api_v1 import router
-from app.db.session import engine
+from app.db.session import engine, AsyncSessionLocal
 from app.db.base import Base
 from app.core.config import settings
+from app.database.embeddings import tune_hnsw_for_table_size
 
 app = FastAPI(
     title="SysML API",
     description="API for SysML diagram generation and management",
     version=settings.APP_VERSION,
+    # orjson serializes the large nested diagram payloads several times
+    # faster than stdlib json
+    default_response_class=ORJSONResponse,
 )
 
+# Explicit allowlists let the middleware precompute its headers instead of
+# rebuilding them per request; the API uses neither cookies nor other methods
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  
-    allow_credentials=True,
-    allow_methods=["*"],  
-    allow_headers=["*"],  
+    allow_origins=settings.cors_origins,
+    allow_credentials=False,
+    allow_methods=["GET", "POST"],
+    allow_headers=["Content-Type"],
 )
 
+# Compress the large diagram JSON payloads; level 5 balances CPU and ratio
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 @app.on_event("startup")
 async def startup():
+    # Build the OpenAPI schema once now instead of lazily on the first
+    # /openapi.json request
+    app.openapi()
+
     # Create tables if they don't exist
     # In production, you'd use Alembic migrations instead
-    async with engine.begin() as conn:
-        # Create tables automatically on startup
-        await conn.run_sync(Base.metadata.create_all)
-        print("Database tables created successfully")
+    # Guarded so multi-worker deployments run the DDL once, not per worker
+    if settings.RUN_DB_INIT:
+        async with engine.begin() as conn:
+            # Create tables automatically on startup
+            await conn.run_sync(Base.metadata.create_all)
+            print("Database tables created successfully")
+
+    # Size the HNSW search parameters to the current table
+    try:
+        async with AsyncSessionLocal() as db:
+            await tune_hnsw_for_table_size(db)
+    except Exception as e:
+        print(f"Warning: could not tune HNSW parameters: {str(e)}")
 
 @app.on_event("shutdown")
 async def shutdown():
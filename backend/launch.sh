@@ -8,4 +8,4 @@ PGPASSWORD=postgres psql -h db -U postgres -d postgres -c "CREATE EXTENSION IF N
 PGPASSWORD=postgres psql -h db -U postgres -d postgres -c "SELECT * FROM pg_extension WHERE extname = 'vector';"
 
 echo "[◦] Starting FastAPI app on port $PORT..."
-uvicorn app.main:app --host 0.0.0.0 --port $PORT --reload
\ No newline at end of file
+uvicorn app.main:app --host 0.0.0.0 --port $PORT --loop uvloop --http httptools --reload
\ No newline at end of file